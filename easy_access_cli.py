@@ -14,7 +14,7 @@ This script can be used to:
     -> all items
     -> only items that have been changed
     -> etc
--> Read back the data from all the sheets to produce a CopyRight 'import' sheet
+-> Read back the data from all the sheets to produce a CopyRight 'import' sheet (experimental, use --import-sheet)
 
 
 Q U I C K    S T A R T
@@ -40,23 +40,25 @@ This python file contains the following:
     - helper classes File and Directory for handling... files and directories.
 """
 
+import functools
+import glob
+import hashlib
 import json
 import os
 import pathlib
+import re
 import shutil
+import stat
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
+from typing import Any, Callable, Iterator
 
 import dotenv
-import openpyxl
-import openpyxl.worksheet
-import openpyxl.worksheet.datavalidation
-import openpyxl.worksheet.table
-import openpyxl.worksheet.worksheet
 import polars as pl
 import typer
-from openpyxl.worksheet.table import Table as ExcelTable
-from openpyxl.worksheet.table import TableStyleInfo
 from rich.console import Console
 from typing_extensions import Annotated
 
@@ -85,14 +87,86 @@ def cool(text: str):
     print(f":smiling_face_with_sunglasses: [yellow] {text} [/yellow]")
 
 
+def read_excel(path: pathlib.Path, **kwargs) -> pl.DataFrame:
+    """
+    Reads an Excel sheet with the fast calamine engine (from the fastexcel package).
+    Falls back to the much slower openpyxl engine if fastexcel is not installed.
+    """
+    try:
+        return pl.read_excel(path, engine="calamine", **kwargs)
+    except ImportError:
+        return pl.read_excel(path, engine="openpyxl", **kwargs)
+
+
+def copyright_column_name(col: str) -> str:
+    """
+    Converts a column header of a CopyRight export to the column name used in the Easy Access sheets.
+    """
+    return col.replace(" ", "_").replace("#", "count_").replace("*", "x").lower()
+
+
+# parsed Excel files are cached here, see cache_df()
+CACHE_DIR = pathlib.Path.home() / ".cache" / "ea-cli"
+# part of the cache key; bump this when the way a cached reader parses a file changes,
+# so frames that were parsed the old way are not loaded from the cache
+CACHE_VERSION = 1
+
+
+def cache_df(func: Callable[[Any, "File"], pl.DataFrame]):
+    """
+    Decorator for methods that read a File into a DataFrame.
+    The result is cached as a parquet file in CACHE_DIR, keyed on the reader, CACHE_VERSION
+    and the absolute path, modification time and size of the file,
+    so an unchanged file is not parsed again on the next run. Older caches of the file by the same reader are removed.
+    If the cache can't be read or written, the file is just parsed.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, file: "File") -> pl.DataFrame:
+        path = file.path.resolve()
+        source = path.stat()
+        prefix = f"{path.stem}_{hashlib.sha1(str(path).encode()).hexdigest()[:12]}_{func.__qualname__}"
+        cache_path = (
+            CACHE_DIR
+            / f"{prefix}_v{CACHE_VERSION}_{source.st_mtime_ns}_{source.st_size}.parquet"
+        )
+        # the cache is best-effort: a broken cache file is re-parsed, a failed write only gives a warning
+        if cache_path.exists():
+            try:
+                # glob=False: the file name contains the name of the sheet, which may contain glob characters
+                return pl.read_parquet(cache_path, glob=False)
+            except (OSError, pl.exceptions.PolarsError):
+                cache_path.unlink(missing_ok=True)
+
+        data = func(self, file)
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            for old_cache in CACHE_DIR.glob(f"{glob.escape(prefix)}_v*.parquet"):
+                old_cache.unlink(missing_ok=True)
+            # write to a temp file first, so an interrupted write never leaves a truncated cache file
+            fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+            os.close(fd)
+            try:
+                data.write_parquet(tmp_path, compression="zstd", compression_level=3)
+                os.replace(tmp_path, cache_path)
+            finally:
+                pathlib.Path(tmp_path).unlink(missing_ok=True)
+        except (OSError, pl.exceptions.PolarsError) as e:
+            warn(f"Could not cache {file.name} in {CACHE_DIR}: {e}")
+        return data
+
+    return wrapper
+
+
 class Directory:
     """
     Simple class for directories + operations.
     Init with an absolute path, or a path relative to the current working directory.
     If the dir does not yet exist, it will be created. Disable this by setting the 'create_dir' parameter to False.
+    If the path is already known to be an existing dir, set 'skip_checks' to True to skip all filesystem calls.
     """
 
-    def __init__(self, path: str, create_dir: bool = True):
+    def __init__(self, path: str, create_dir: bool = True, skip_checks: bool = False):
         self.input_path_str = path
         self.create_dir = create_dir
 
@@ -102,40 +176,72 @@ class Directory:
         else:
             self.full = pathlib.Path.cwd() / path
 
-        self.post_init()
+        if not skip_checks:
+            self.post_init()
 
     def post_init(self) -> None:
         """
         Checks to see if this is actually a dir,
         or create it if create_dir is set to True.
+        Uses a single stat call for both checks.
         """
-        if not self.full.exists():
-            if self.create_dir:
-                self.create()
-            else:
+        try:
+            mode = self.full.stat().st_mode
+        except FileNotFoundError:
+            if not self.create_dir:
                 raise FileNotFoundError(
                     f"Directory {self.full} does not exist and create_dir is set to False."
                 )
-        if not self.full.is_dir():
+            self.create()
+            return
+        if not stat.S_ISDIR(mode):
             raise NotADirectoryError(f"Directory {self.full} is not a directory.")
 
+    # cached directory listings: path -> (mtime_ns of the dir, files, subdirs)
+    _listing_cache: dict[pathlib.Path, tuple[int, list["File"], list["Directory"]]] = {}
+
+    def _scan(self) -> tuple[list["File"], list["Directory"]]:
+        """
+        Lists the files and subdirs directly inside this dir with a single os.scandir call.
+        The result is cached per path, and reused as long as the mtime of the dir is unchanged.
+        """
+        mtime = self.full.stat().st_mtime_ns
+        cached = Directory._listing_cache.get(self.full)
+        if cached and cached[0] == mtime:
+            return cached[1], cached[2]
+
+        files = []
+        subdirs = []
+        with os.scandir(self.full) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    files.append(File._from_dir_entry(entry, self))
+                # don't follow symlinked dirs: a link back to a parent dir would make files_r loop forever
+                elif entry.is_dir(follow_symlinks=False):
+                    subdirs.append(Directory(entry.path, skip_checks=True))
+        Directory._listing_cache[self.full] = (mtime, files, subdirs)
+        return files, subdirs
+
     @property
     def files(self) -> list["File"]:
         """
         Gets all files in the dir as a list of File objects.
         """
-        return [
-            File(self.full / file) for file in self.full.iterdir() if file.is_file()
-        ]
+        return list(self._scan()[0])
 
     @property
     def files_r(self) -> list["File"]:
         """
         Recursively gets all files in the dir, so including files in subdirs, as a list of File objects.
         """
-        return [
-            File(self.full / file) for file in self.full.rglob("*") if file.is_file()
-        ]
+        files = []
+        stack = [self]
+        while stack:
+            directory = stack.pop()
+            dir_files, subdirs = directory._scan()
+            files.extend(dir_files)
+            stack.extend(subdirs)
+        return files
 
     @property
     def dirs(self, r: bool = False) -> list["Directory"]:
@@ -143,10 +249,31 @@ class Directory:
         Returns a list of all dirs in this Directory as a list of Directory objects.
         If r is set to True, it will return all children dirs recursively.
         """
+        subdirs = list(self._scan()[1])
         if not r:
-            return [Directory(self, d) for d in self.full.iterdir() if d.is_dir()]
-        if r:
-            return [Directory(self, d) for d in self.full.rglob("*") if d.is_dir()]
+            return subdirs
+        all_dirs = []
+        while subdirs:
+            directory = subdirs.pop()
+            all_dirs.append(directory)
+            subdirs.extend(directory._scan()[1])
+        return all_dirs
+
+    def numbered_filename(self, stem: str, extension: str) -> str:
+        """
+        Returns the filename '{stem}{extension}' if it's not yet used in this dir.
+        Otherwise, appends a number one higher than the highest one in use: '{stem}_1{extension}', '{stem}_2{extension}', etc.
+        Uses the (cached) listing of the dir instead of checking each candidate on disk.
+        """
+        pattern = re.compile(rf"{re.escape(stem)}(?:_(\d+))?{re.escape(extension)}")
+        numbers = [
+            int(match.group(1) or 0)
+            for file in self.files
+            if (match := pattern.fullmatch(file.name))
+        ]
+        if not numbers:
+            return f"{stem}{extension}"
+        return f"{stem}_{max(numbers) + 1}{extension}"
 
     @property
     def newest_file(self) -> "File":
@@ -154,15 +281,15 @@ class Directory:
         Returns the newest file in the dir as a File object.
         """
         all_files = self.files
-        return max(all_files, key=lambda x: x.created())
+        return max(all_files, key=lambda x: x._stat.st_birthtime)
 
     @property
-    def newest_file_r(self) -> str:
+    def newest_file_r(self) -> "File":
         """
         Recursively gets the newest file in the dir, so including files in subdirs, as a File object.
         """
         all_files = self.files_r
-        return max(all_files, key=lambda x: x.created())
+        return max(all_files, key=lambda x: x._stat.st_birthtime)
 
     @property
     def exists(self) -> bool:
@@ -220,6 +347,20 @@ class File:
             self._extension = self._name.split(".")[-1]
             self._path = self._dir.full / self._name
 
+    @classmethod
+    def _from_dir_entry(cls, entry: os.DirEntry, parent_dir: Directory) -> "File":
+        """
+        Creates a File from a DirEntry found while scanning parent_dir,
+        without re-parsing the path or constructing a new Directory for the parent.
+        """
+        file = cls.__new__(cls)
+        file._path_init_str = entry.path
+        file._path = pathlib.Path(entry.path)
+        file._name = entry.name
+        file._extension = file._path.suffix
+        file._dir = parent_dir
+        return file
+
     @property
     def exists(self) -> bool:
         return self._path.exists()
@@ -244,13 +385,20 @@ class File:
     def dir(self) -> Directory:
         return self._dir
 
+    @functools.cached_property
+    def _stat(self) -> os.stat_result:
+        """
+        The stat result of the file, cached so that created/modified don't call stat on every access.
+        """
+        return self._path.stat()
+
     @property
     def created(self) -> datetime:
-        return datetime.fromtimestamp(self._path.stat().st_birthtime)
+        return datetime.fromtimestamp(self._stat.st_birthtime)
 
     @property
     def modified(self) -> datetime:
-        return datetime.fromtimestamp(self._path.stat().st_mtime)
+        return datetime.fromtimestamp(self._stat.st_mtime)
 
     def copy(self, new_path: str) -> "File":
         shutil.copy(self._path, new_path)
@@ -262,6 +410,7 @@ class File:
 
     def rename(self, new_name: str) -> "File":
         self._path = self._dir.full / new_name
+        self.__dict__.pop("_stat", None)
         return File(self._path)
 
     def __eq__(self, other) -> bool:
@@ -287,6 +436,33 @@ class Functions(str, Enum):
     export = "export"
 
 
+@dataclass(slots=True, frozen=True)
+class ValidationReport:
+    """
+    Result of EasyAccessTool.validate_ea_sheet()
+    ok: True if the sheet passed all checks
+    df: the (fixed) data of the sheet, None if it didn't pass
+    errors: the errors found in the sheet
+    """
+
+    ok: bool
+    df: pl.DataFrame | None
+    errors: tuple[str, ...]
+
+
+# the EA sheets are read in as str, these columns are converted back for the import sheet (see create_import_sheet)
+# keyed on the Easy Access column names
+IMPORT_DTYPES: dict[str, pl.DataType] = {
+    "material_id": pl.Int64,
+    "last_change": pl.Date,
+    "pagecount": pl.Int64,
+    "wordcount": pl.Int64,
+    "picturecount": pl.Int64,
+    "pages_x_students": pl.Int64,
+    "count_students_registered": pl.Int64,
+}
+
+
 # The main CLI function:
 def cli(
     do: Annotated[
@@ -304,6 +480,13 @@ def cli(
             rich_help_panel="Functions",
         ),
     ] = True,
+    import_sheet: Annotated[
+        bool,
+        typer.Option(
+            help="Also create a sheet to import into CopyRight. Experimental: it does not contain the data entered in the 'Data entry' sheets yet.",
+            rich_help_panel="Functions",
+        ),
+    ] = False,
     other_sheet: Annotated[
         str | None,
         typer.Option(
@@ -351,7 +534,7 @@ def cli(
     Example usage\n
     --------------\n
     ea-cli\n
-    ea-cli --do export\n
+    ea-cli --do export --import-sheet\n
     ea-cli --no-changes\n
     ea-cli --do read --changes\n
     ea-cli --do both --copyright_export_dir 'C:/easy_access_sheets/cli_copyright_data'  \n
@@ -383,7 +566,11 @@ def cli(
         }
 
     tool = EasyAccessTool(
-        functions=do, only_changes=changes, dirs=dirs, other_sheet=other_sheet
+        functions=do,
+        only_changes=changes,
+        dirs=dirs,
+        other_sheet=other_sheet,
+        import_sheet=import_sheet,
     )
     tool.run()
 
@@ -400,26 +587,31 @@ class EasyAccessTool:
 
     # keep track of relevant files and directories
     files: dict[str, File]
-    dirs: dict[str, Directory] = {
-        "root": Directory(os.getcwd()),
-        "copyright_export": Directory(os.getenv("COPYRIGHT_EXPORT_DIR")),
-        "copyright_import": Directory(os.getenv("COPYRIGHT_IMPORT_DIR")),
-        "all_items": Directory(os.getenv("ALL_ITEMS_DIR")),
-        "faculties": Directory(os.getenv("FACULTIES_DIR")),
+    dirs: dict[str, Directory]
+
+    # the dirs used by each function, so only the ones needed for a run are created
+    # the default location of dir 'x' is set in settings.env as 'X_DIR'
+    required_dirs: dict[str, set[str]] = {
+        "read_copyright_export": {"copyright_export"},
+        "process_copyright_export": {"faculties"},
+        "read_faculty_sheets": {"faculties"},
+        "read_all_items_sheet": {"all_items"},
+        "create_import_sheet": {"copyright_import", "copyright_export"},
+        "create_faculty_sheets": {"faculties"},
+        "create_all_items_sheet": {"all_items"},
     }
 
     # the various dataframes created from / writing to .xlsx files
     raw_copyright_data: pl.DataFrame = pl.DataFrame()  # data directly from copyRight
+    copyright_columns: dict[
+        str, str
+    ] = {}  # EA column name -> column header in the CopyRight export
     copyright_data: pl.DataFrame = pl.DataFrame()  # data with a bit of cleanup
     faculty_sheet_data: pl.DataFrame = pl.DataFrame()  # data from the faculty sheets
     all_items_sheet_data: pl.DataFrame = (
         pl.DataFrame()
     )  # data from the 'all_items' sheet
 
-    # maps copyright data column 'departments' to faculties
-    dept_mapping_path = File("department_mapping.json")
-    DEPARTMENT_MAPPING = json.load(open(dept_mapping_path.path, encoding="utf-8"))
-
     # list of all found/used faculties
     faculties: list[str]
 
@@ -435,6 +627,44 @@ class EasyAccessTool:
 
     # flag to indicate if there are no new items to add
     no_new_items: bool = False
+    # dropdowns in the 'Data entry' sheet, as xlsxwriter data validation options per column letter
+    # these are static, so they are only built once instead of for each sheet
+    entry_dropdowns: dict[str, dict] = {
+        col_letter: {
+            "validate": "list",
+            "source": itemlist,
+            "ignore_blank": False,
+            "error_message": "Please select a valid option from the list",
+            "error_title": "Invalid option",
+            "input_message": "Please select from the list",
+            "input_title": "List selection",
+        }
+        for col_letter, itemlist in [
+            ("B", '"ToDo,Done,InProgress"'),  # workflow status
+            (
+                "C",
+                '"open access, eigen materiaal - powerpoint, eigen materiaal - overig, lange overname, eigen materiaal - titelindicatie"',
+            ),  # manual classification
+        ]
+    }
+
+    # checks for the values in an EA sheet, used in validate_ea_sheet
+    # column name -> expression that is True for each invalid value (on the str columns of the sheet)
+    value_checks: dict[str, pl.Expr] = {
+        "material_id": pl.col("material_id").cast(pl.Int64, strict=False).is_null(),
+        "last_change": (
+            pl.col("last_change").is_not_null()
+            & pl.col("last_change")
+            .str.slice(0, 10)
+            .str.to_date("%Y-%m-%d", strict=False)
+            .is_null()
+        ),
+        "workflow_status": (
+            pl.col("workflow_status").is_not_null()
+            & ~pl.col("workflow_status").is_in(["ToDo", "Done", "InProgress"])
+        ),
+    }
+
     # standard column order for the complete data sheets
     column_order = [
         "material_id",
@@ -473,6 +703,8 @@ class EasyAccessTool:
         "workflow_status",
         "faculty",
     ]
+    # set of the same columns, so validate_ea_sheet doesn't have to rebuild it for every sheet
+    expected_columns = frozenset(column_order)
 
     def __init__(
         self,
@@ -480,6 +712,7 @@ class EasyAccessTool:
         dirs: dict[str, str] | None = None,
         only_changes: bool = True,
         other_sheet: str | None = None,
+        import_sheet: bool = False,
     ) -> None:
         """
         Parameters:
@@ -497,6 +730,9 @@ class EasyAccessTool:
                 False: add all items from the CopyRight export to the created sheets
             other_sheets: list[str] | None
                 A list of paths to additional .xlsx files to ingest instead the raw data from CopyRight.
+            import_sheet: bool = False
+                True: also create the sheet to import into CopyRight, if the selected functions include it
+                False (default): skip it, as it doesn't contain the data entered in the faculty sheets yet
         """
 
         # determine which functions to run
@@ -558,11 +794,40 @@ class EasyAccessTool:
                     f"Note: Only exporting data, so the contents of other sheet {self.other_sheet} will have no effect on the output."
                 )
 
-        # if dirs is set, add them to the self.dirs dict
-        if dirs:
-            for key, value in dirs.items():
-                if value:
-                    self.dirs[key] = Directory(value)
+        # the import sheet doesn't contain the data entered in the faculty sheets yet (see read_sheets),
+        # so only create it when explicitly asked, to avoid importing stale data into CopyRight
+        if not import_sheet and self.create_import_sheet in self.settings:
+            self.settings.remove(self.create_import_sheet)
+            info(
+                "Not creating a CopyRight import sheet; use --import-sheet to create it anyway."
+            )
+
+        # set up the dirs needed for the selected functions
+        # if dirs is set, use those paths instead of the defaults from settings.env
+        dirs = {key: value for key, value in (dirs or {}).items() if value}
+        needed = set(dirs)
+        for func in self.settings:
+            needed |= self.required_dirs.get(func.__name__, set())
+
+        self.dirs = {"root": Directory(os.getcwd())}
+        for key in sorted(needed):
+            path = dirs.get(key) or os.getenv(f"{key.upper()}_DIR")
+            if not path:
+                warn(
+                    f"No directory set for '{key}'. Add {key.upper()}_DIR to settings.env, or pass it as an argument."
+                )
+                raise typer.Exit(code=1)
+            self.dirs[key] = Directory(path)
+
+    @functools.cached_property
+    def DEPARTMENT_MAPPING(self) -> dict[str, str]:
+        """
+        Maps copyright data column 'department' to faculties.
+        Only read from department_mapping.json when it's actually used.
+        """
+        return json.loads(
+            File("department_mapping.json").path.read_text(encoding="utf-8")
+        )
 
     def run(self) -> None:
         """
@@ -580,7 +845,7 @@ class EasyAccessTool:
         """
 
         info(f"Reading in data from {self.other_sheet.name}")
-        self.copyright_data = pl.read_excel(self.other_sheet.path)
+        self.copyright_data = read_excel(self.other_sheet.path)
         self.latest_file_date = self.other_sheet.modified.strftime("%Y-%m-%d")
         info(
             f"Read {len(self.copyright_data)} items from {self.other_sheet.name}. Item was lasted changed on {self.latest_file_date}"
@@ -603,11 +868,9 @@ class EasyAccessTool:
                     {"added_to_sheet_on": "retrieved_from_copyright_on"}
                 )
 
-        self.latest_file_date = max(
-            self.copyright_data.select(pl.col("retrieved_from_copyright_on"))
-            .to_series()
-            .to_list()
-        )
+        self.latest_file_date = self.copyright_data.select(
+            pl.col("retrieved_from_copyright_on").max()
+        ).item()
         self.copyright_data = self.copyright_data.select(self.column_order)
 
     def read_copyright_export(self) -> None:
@@ -616,12 +879,12 @@ class EasyAccessTool:
         )
         try:
             all_files = self.dirs["copyright_export"].files
-            self.latest_file = max(all_files, key=lambda x: x.created)
+            self.latest_file = max(all_files, key=lambda x: x._stat.st_birthtime)
             self.latest_file_date = self.latest_file.created.strftime("%Y-%m-%d")
             info(
                 f"Selected newest copyright export file:\n          {self.latest_file.name}\n          created @ {self.latest_file_date}"
             )
-            self.raw_copyright_data = pl.read_excel(self.latest_file.path)
+            self.raw_copyright_data = read_excel(self.latest_file.path)
         except FileNotFoundError:
             warn(f"No files found in {self.dirs['copyright_export']}")
             raise typer.Exit(code=1)
@@ -641,21 +904,37 @@ class EasyAccessTool:
         and only include new items in the export.
         """
         if self.copyright_data.is_empty():
-            self.copyright_data = self.raw_copyright_data.rename(
-                lambda col: col.replace(" ", "_")
-                .replace("#", "count_")
-                .replace("*", "x")
-                .lower()
-            ).with_columns(
-                pl.Series(
-                    "retrieved_from_copyright_on",
-                    [self.latest_file_date] * len(self.raw_copyright_data),
-                ),
-                pl.Series("workflow_status", ["ToDo"] * len(self.raw_copyright_data)),
-                pl.col("last_change").dt.strftime("%Y-%m-%d"),
-                faculty=pl.col("department").replace_strict(
-                    self.DEPARTMENT_MAPPING, default="Unmapped"
-                ),
+            column_mapping = {
+                col: copyright_column_name(col)
+                for col in self.raw_copyright_data.columns
+            }
+            # the renaming is lossy (.lower()), so keep the original headers for the import sheet
+            self.copyright_columns = {name: col for col, name in column_mapping.items()}
+            # these columns are added below, all others should be in the export
+            missing = set(self.column_order) - set(column_mapping.values())
+            missing -= {"retrieved_from_copyright_on", "workflow_status", "faculty"}
+            if missing:
+                warn(
+                    f"CopyRight export {self.latest_file.name} is missing columns: {', '.join(sorted(missing))}"
+                )
+                raise typer.Exit(code=1)
+
+            self.copyright_data = (
+                self.raw_copyright_data.rename(column_mapping)
+                .with_columns(
+                    pl.Series(
+                        "retrieved_from_copyright_on",
+                        [self.latest_file_date] * len(self.raw_copyright_data),
+                    ),
+                    pl.Series(
+                        "workflow_status", ["ToDo"] * len(self.raw_copyright_data)
+                    ),
+                    pl.col("last_change").dt.strftime("%Y-%m-%d"),
+                    faculty=pl.col("department").replace_strict(
+                        self.DEPARTMENT_MAPPING, default="Unmapped"
+                    ),
+                )
+                .select(self.column_order)
             )
 
         if self.only_changes:
@@ -668,79 +947,105 @@ class EasyAccessTool:
                 # compare self.copyright_data with self.faculty_sheet_data
                 # only keep items from self.copyright_data with a value in col material_id that is not in self.faculty_sheet_data
                 # AND items with a matching material_id but a different value in col last_change
-                not_in_faculty = self.copyright_data.join(
-                    self.faculty_sheet_data, on="material_id", how="anti"
-                )
-                matching_id_diff_change = (
-                    self.copyright_data.join(
-                        self.faculty_sheet_data, on="material_id", how="inner"
+                # this is done in a single lazy left join; the faculty sheets are read in as str, so cast the keys first
+                schema = self.copyright_data.schema
+                faculty_items = (
+                    self.faculty_sheet_data.lazy()
+                    .select(
+                        pl.col("material_id").cast(schema["material_id"], strict=False),
+                        pl.col("last_change")
+                        .cast(schema["last_change"], strict=False)
+                        .alias("last_change_right"),
+                        pl.lit(True).alias("in_faculty"),
                     )
-                    .filter(pl.col("last_change") != pl.col("last_change_right"))
-                    .select(pl.all().exclude("last_change_right"))
-                    .drop_nulls(pl.col("material_id"))
-                    .filter(pl.col("status") == "Deleted")
+                    .unique()
                 )
-
-                if not_in_faculty.is_empty():
-                    if matching_id_diff_change.is_empty():
-                        info("No new items to add!")
-                        self.no_new_items = True
-                    else:
-                        self.copyright_data = matching_id_diff_change
-                if not matching_id_diff_change.is_empty():
-                    self.copyright_data = pl.concat(
-                        [not_in_faculty, matching_id_diff_change]
+                self.copyright_data = (
+                    self.copyright_data.lazy()
+                    .join(faculty_items, on="material_id", how="left")
+                    .filter(
+                        pl.col("in_faculty").is_null()
+                        | (
+                            (pl.col("last_change") != pl.col("last_change_right"))
+                            & (pl.col("status") == "Deleted")
+                        )
                     )
-                else:
-                    self.copyright_data = not_in_faculty
-
-        self.faculties = (
-            self.copyright_data.select(pl.col("faculty").unique()).to_series().to_list()
-        )
+                    .drop("last_change_right", "in_faculty")
+                    .collect()
+                )
+                if self.copyright_data.is_empty():
+                    info("No new items to add!")
+                    self.no_new_items = True
 
     def create_faculty_sheets(self) -> None:
         """
         Splits the processed copyright data into one sheet per faculty
         and exports the result to excel sheets.
         """
-        if self.faculties:
-            self.faculties.sort()
+        # split the data per faculty in a single pass
+        # items without a faculty (null or "", e.g. from another sheet) are grouped together first,
+        # so they end up in a single partition instead of two with the same name
+        faculty_parts = {
+            faculty: faculty_data
+            for (faculty,), faculty_data in self.copyright_data.with_columns(
+                pl.col("faculty")
+                .cast(pl.Utf8)
+                .replace("", None)
+                .fill_null("no_faculty_found")
+            )
+            .partition_by("faculty", as_dict=True)
+            .items()
+        }
+        self.faculties = sorted(faculty_parts)
         for faculty in self.faculties:
-            faculty_dir = Directory(self.dirs["faculties"].full / faculty)
-            if faculty is None or faculty == "":
-                faculty = "no_faculty_found"
-            filename = f"{faculty}_{self.latest_file_date}.xlsx"
-            i = 1
-            while os.path.exists(faculty_dir.full / filename):
-                filename = f"{faculty}_{self.latest_file_date}_{i}.xlsx"
-                i += 1
-
-            faculty_data = self.copyright_data.filter(pl.col("faculty") == faculty)
-
-            if faculty_data.is_empty():
-                warn(f"No items found for faculty {faculty}.")
+            faculty_data = faculty_parts[faculty]
+            faculty_dir = Directory(str(self.dirs["faculties"].full / faculty))
+            filename = faculty_dir.numbered_filename(
+                f"{faculty}_{self.latest_file_date}", ".xlsx"
+            )
 
-            faculty_data.write_excel(faculty_dir.full / filename)
+            self.write_faculty_sheet(
+                faculty_data, File(str(faculty_dir.full / filename))
+            )
             info(f"Created sheet {filename}")
-            self.finalize_sheet(File(str(faculty_dir.full / filename)))
 
-    def finalize_sheet(self, file: File) -> None:
+    def open_workbook(self, file: File, constant_memory: bool = False):
         """
-        Add the data entry sheet to a fresh Faculty Excel file.
-        This sheet will contain a selection of columns, will be styled,
-        and contain dropdowns for data entry.
+        Opens a new xlsxwriter Workbook to export a sheet to, with the options shared by all exports.
+        strings_to_urls is disabled so xlsxwriter doesn't check every string cell for a url;
+        only the url column contains links, add those with write_urls().
+        With constant_memory, each row is flushed to disk once the next row is started,
+        so rows have to be written in order and tables can't be used.
         """
+        # only needed when writing sheets, so don't import it at startup
+        import xlsxwriter
+
+        return xlsxwriter.Workbook(
+            str(file.path),
+            {
+                "constant_memory": constant_memory,
+                "default_date_format": "yyyy-mm-dd",
+                "nan_inf_to_errors": True,
+                "strings_to_formulas": False,
+                "strings_to_urls": False,
+            },
+        )
 
-        wb = openpyxl.load_workbook(filename=str(file.path))
-        wb.active.title = "Complete data"
-
-        # Create the Data Entry sheet
-        # -----------------------------
+    def write_urls(self, worksheet, urls: pl.Series, col: int) -> None:
+        """
+        Writes the urls as hyperlinks in column col of an xlsxwriter worksheet, below the header row.
+        """
+        for row, url in enumerate(urls, start=1):
+            if url:
+                worksheet.write_url(row, col, url)
 
-        entry_sheet: openpyxl.worksheet.worksheet.Worksheet = wb.create_sheet(
-            "Data entry", index=1
-        )
-        keep_cols = [6, 34, 14, 16, 17, 13, 1, 8, 9, 28, 3, 5, ""]
+    def write_faculty_sheet(self, faculty_data: pl.DataFrame, file: File) -> None:
+        """
+        Writes a Faculty Excel file in a single pass with xlsxwriter.
+        The file contains two sheets:
+            'Complete data': all columns of faculty_data
+            'Data entry': a selection of columns, styled as a table, with dropdowns for data entry.
+        """
         col_names = [
             "url",
             "workflow_status",
@@ -755,75 +1060,56 @@ class EasyAccessTool:
             "department",
             "course_name",
         ]
-        max_row = 0
-        url = False
-
-        for new_col, old in enumerate(keep_cols, start=1):
-            if isinstance(old, str):
-                break
-            for row, cell in enumerate(
-                wb.active.iter_rows(min_col=old, max_col=old, values_only=True), start=1
-            ):
-                if row == 1 and cell[0] == "url":
-                    url = True
-                elif row == 1:
-                    url = False
-                if not url:
-                    entry_sheet.cell(row=row, column=new_col).value = cell[0]
-                else:
-                    entry_sheet.cell(row=row, column=new_col).hyperlink = cell[0]
-                if row > max_row:
-                    max_row = row
-
-        for col, name in enumerate(col_names, start=1):
-            entry_sheet.cell(row=1, column=col, value=name)
-
-        # Dropdown items for certain cells
-        # -----------------------------------
-        dropdowndata = [
-            (2, "B", '"ToDo,Done,InProgress"'),  # workflow status
-            (
-                3,
-                "C",
-                '"open access, eigen materiaal - powerpoint, eigen materiaal - overig, lange overname, eigen materiaal - titelindicatie"',
-            ),  # manual classification
-        ]
-        for colnum, col_letter, itemlist in dropdowndata:
-            dv = openpyxl.worksheet.datavalidation.DataValidation(
-                type="list", formula1=itemlist, allow_blank=False
+        max_row = len(faculty_data) + 1
+
+        with self.open_workbook(file) as wb:
+            # Create the Complete data & Data entry sheets
+            # -----------------------------
+            faculty_data.write_excel(workbook=wb, worksheet="Complete data")
+            faculty_data.select(col_names).write_excel(
+                workbook=wb,
+                worksheet="Data entry",
+                table_name="DataEntry",
+                table_style=f"TableStyleMedium{self.style_iter}",
             )
-            dv.error = "Please select a valid option from the list"
-            dv.errorTitle = "Invalid option"
-            dv.prompt = "Please select from the list"
-            dv.promptTitle = "List selection"
-            entry_sheet.add_data_validation(dv)
-            dv.add(f"{col_letter}2:{col_letter}{max_row}")
-
-        # Style as table
-        # -----------------
-        table = ExcelTable(displayName="DataEntry", ref=f"A1:L{max_row}")
-        tabstyle = TableStyleInfo(
-            name=f"TableStyleMedium{self.style_iter}",
-            showRowStripes=True,
-        )
-        self.style_iter = self.style_iter + 1
-        table.tableStyleInfo = tabstyle
-        entry_sheet.add_table(table)
+            self.style_iter = self.style_iter + 1
+            entry_sheet = wb.get_worksheet_by_name("Data entry")
+
+            # Hyperlinks for the url column in both sheets
+            # -----------------------------------
+            urls = faculty_data.get_column("url")
+            self.write_urls(
+                wb.get_worksheet_by_name("Complete data"),
+                urls,
+                faculty_data.columns.index("url"),
+            )
+            self.write_urls(entry_sheet, urls, 0)
 
-        wb.save(filename=str(file.path))
+            # Dropdown items for certain cells
+            # -----------------------------------
+            for col_letter, options in self.entry_dropdowns.items():
+                entry_sheet.data_validation(
+                    f"{col_letter}2:{col_letter}{max_row}", options
+                )
 
     def create_all_items_sheet(self) -> None:
         """
         Add all items in the current Copyright data to a single sheet for CIP ease of use.
         """
         if not self.no_new_items:
-            filename = f"all_items_{self.latest_file_date}.xlsx"
-            i = 1
-            while os.path.exists(self.dirs["all_items"].full / filename):
-                filename = f"all_items_{self.latest_file_date}_{i}.xlsx"
-                i += 1
+            filename = self.dirs["all_items"].numbered_filename(
+                f"all_items_{self.latest_file_date}", ".xlsx"
+            )
 
-            self.copyright_data.write_excel(self.dirs["all_items"].full / filename)
+            with self.open_workbook(
+                File(str(self.dirs["all_items"].full / filename))
+            ) as wb:
+                self.copyright_data.write_excel(workbook=wb)
+                self.write_urls(
+                    wb.worksheets()[0],
+                    self.copyright_data.get_column("url"),
+                    self.copyright_data.columns.index("url"),
+                )
             info(f"Created sheet: {self.dirs['all_items'].full / filename}")
 
     def read_faculty_sheets(self) -> None:
@@ -850,62 +1136,159 @@ class EasyAccessTool:
         Currently only reads in the data from the sheet 'Complete data'.
         TODO: Handle ingestion of data the faculty added to the sheet.
         """
-        file_data = []
+        excel_files: list[File] = []
         for file in files:
             if file.extension not in [".xls", ".xlsx"]:
                 warn(f"{file.name} is not an excel file, skipping.")
                 continue
-            try:
-                current_data = pl.read_excel(file.path, sheet_name="Complete data")
-            except Exception:
-                current_data = pl.read_excel(file.path)
+            excel_files.append(file)
+        if not excel_files:
+            return pl.DataFrame()
 
-            current_data = self.validate_ea_sheet(current_data, file)
-            if current_data.is_empty():
-                continue
-            else:
-                file_data.append(current_data)
-        if file_data:
-            result: pl.DataFrame = pl.concat(file_data)
-        else:
-            result = pl.DataFrame()
-        return result.unique()
+        # each sheet is read & validated independently, mostly in calamine/polars code that releases the GIL,
+        # so threads are enough to do this in parallel
+        with ThreadPoolExecutor(max_workers=min(8, len(excel_files))) as executor:
+            reports = list(
+                executor.map(
+                    lambda file: self.validate_ea_sheet(self.read_ea_sheet(file), file),
+                    excel_files,
+                )
+            )
+        # the modification time & path of the sheet are only used to break ties when deduplicating, see below
+        lazy_frames = [
+            report.df.lazy().with_columns(
+                pl.lit(file._stat.st_mtime_ns).alias("sheet_modified"),
+                pl.lit(str(file.path)).alias("sheet_path"),
+            )
+            for file, report in zip(excel_files, reports)
+            if report.ok
+        ]
+        if not lazy_frames:
+            return pl.DataFrame()
+        # concat + dedupe in a single lazy query instead of materializing each step
+        # material_id identifies an item, so there's no need to hash all columns
+        # the newest version of an item is determined by its data, not by the file it's in:
+        # a faculty can edit (and so save) an older sheet at any time
+        # both columns are YYYY-MM-DD strings, so sorting them as str sorts them by date
+        # if those are equal (e.g. two sheets created on the same day), the most recently saved sheet wins
+        return (
+            pl.concat(lazy_frames, how="vertical_relaxed")
+            .sort(
+                "retrieved_from_copyright_on",
+                "last_change",
+                "sheet_modified",
+                "sheet_path",
+            )
+            .unique(subset="material_id", keep="last")
+            .drop("sheet_modified", "sheet_path")
+            .collect()
+        )
+
+    @cache_df
+    def read_ea_sheet(self, file: File) -> pl.DataFrame:
+        """
+        Reads the sheet 'Complete data' (or the first sheet if it's not there) from an Excel file.
+        All columns are read in as str (infer_schema_length=0), so they don't need to be cast afterwards.
+        """
+        try:
+            return read_excel(
+                file.path, sheet_name="Complete data", infer_schema_length=0
+            )
+        except Exception:
+            return read_excel(file.path, infer_schema_length=0)
 
-    def validate_ea_sheet(self, df: pl.DataFrame, file: File) -> pl.DataFrame:
+    def validate_ea_sheet(self, df: pl.DataFrame, file: File) -> ValidationReport:
         """
         For a given dataframe created from an EA excel sheet,
-        check the data for errors.
-        If found, try to fix, else print the errors.
-        If the sheet is not validated, return an empty dataframe.
+        check the data for errors and print them.
+        Returns a ValidationReport with the data if the sheet is valid, or the errors if not.
 
-        Current implementation is bare:
+        Checks:
         - is sheet empty? if yes: print error
-        - set all columns to type str
+        - run all checks in _run_checks(), print the errors if there are any:
+            - all columns in column_order should be present
+            - all columns should be of type str
+            - check the values in the columns with value_checks
+        The only things that are fixed instead of reported: extra columns are dropped, and the order of the columns is restored.
 
-        TODO: Implement this function fully.
         TODO: handle multiple sheets in the same file
 
         """
-        valid = True
-        errlist = []
         if df.is_empty():
-            valid = False
-            errlist.append("Sheet is empty")
-        if valid:
-            # set all columns to type str
-            df = df.with_columns(pl.exclude(pl.Utf8).cast(str))
-            # check that the sheet has the correct columns
-            ...
-        if valid:
-            # check the values in the columns
-            ...
-        if not valid:
-            info(f"Errors in sheet {file}:")
-            for err in errlist:
-                warn(err)
-            return pl.DataFrame()
-        else:
-            return df
+            return self._failed_validation(file, ["Sheet is empty"])
+
+        errlist = list(self._run_checks(df))
+        if errlist:
+            return self._failed_validation(file, errlist)
+
+        # extra columns are dropped and the order is restored
+        if df.columns != self.column_order:
+            df = df.select(self.column_order)
+
+        return ValidationReport(True, df, ())
+
+    def _run_checks(self, df: pl.DataFrame) -> Iterator[str]:
+        """
+        Yields all errors found in the data of an EA sheet.
+        The values can only be checked if the columns and their types are correct.
+        """
+        structure_errors = [*self._check_columns(df), *self._check_dtypes(df)]
+        yield from structure_errors
+        if not structure_errors:
+            yield from self._check_values(df)
+
+    def _check_columns(self, df: pl.DataFrame) -> Iterator[str]:
+        """
+        Yields an error if any of the columns in column_order is missing.
+        Extra columns or a different order are not errors, those are fixed in validate_ea_sheet.
+        """
+        missing = self.expected_columns.difference(df.columns)
+        if missing:
+            yield f"Missing column(s): {', '.join(sorted(missing))}"
+
+    def _check_dtypes(self, df: pl.DataFrame) -> Iterator[str]:
+        """
+        Yields an error for each column that is not of type str.
+        All columns should already be read in as str, see read_ea_sheet.
+        """
+        for col, dtype in df.schema.items():
+            if dtype != pl.Utf8:
+                yield f"Column '{col}' is of type {dtype}, expected str"
+
+    def _check_values(self, df: pl.DataFrame) -> Iterator[str]:
+        """
+        Yields an error for each column with invalid values, see value_checks.
+        """
+        invalid_rows = self._validate_lazy(df.lazy()).collect()
+        if invalid_rows.is_empty():
+            return
+        for col in self.value_checks:
+            rows = invalid_rows.filter(pl.col(col)).get_column("row")
+            if not rows.is_empty():
+                shown_rows = ", ".join(map(str, rows.head(10)))
+                if len(rows) > 10:
+                    shown_rows += ", ..."
+                yield f"{len(rows)} invalid value(s) in column '{col}', in row(s): {shown_rows}"
+
+    def _failed_validation(self, file: File, errlist: list[str]) -> ValidationReport:
+        """
+        Prints the errors found in a sheet and returns the matching ValidationReport.
+        """
+        # a single warning with all errors, instead of one print per error
+        warn(f"Errors in sheet {file}:\n  - " + "\n  - ".join(errlist))
+        return ValidationReport(False, None, tuple(errlist))
+
+    def _validate_lazy(self, lf: pl.LazyFrame) -> pl.LazyFrame:
+        """
+        Applies all value_checks to the (lazy) data of an EA sheet.
+        Returns only the invalid rows: the row number in the sheet and a bool column per check.
+        Everything is done in a single query, so polars can fuse the checks and only collects once.
+        """
+        return (
+            lf.with_row_index("row", offset=2)
+            .select("row", **self.value_checks)
+            .filter(pl.any_horizontal(pl.exclude("row")))
+        )
 
     def create_import_sheet(self) -> None:
         """
@@ -914,8 +1297,105 @@ class EasyAccessTool:
         change from UT Easy Access format to SURF CopyRight format
         create & export an .xlsx sheet that can be sent to SURF to be imported into CopyRight.
         """
-        # TODO
-        ...
+        # combine both sources; the faculty sheets are last, so their version of an item is kept when deduplicating
+        sources = [
+            data.lazy()
+            for data in (self.all_items_sheet_data, self.faculty_sheet_data)
+            if not data.is_empty()
+        ]
+        if not sources:
+            info("No data found in the sheets, not creating an import sheet.")
+            return
+        combined_data = (
+            pl.concat(sources, how="vertical_relaxed")
+            .unique(subset="material_id", keep="last", maintain_order=True)
+            .collect()
+        )
+
+        # SURF CopyRight format: the original column headers and dtypes of the CopyRight export
+        import_columns = self.read_copyright_columns()
+        if not import_columns:
+            warn(
+                f"No CopyRight export found in {self.dirs['copyright_export']}, its column headers are needed for the import sheet. Not creating an import sheet."
+            )
+            return
+        dtype_exprs = {
+            col: pl.col(col).str.slice(0, 10).str.to_date("%Y-%m-%d", strict=False)
+            if dtype == pl.Date
+            else pl.col(col).cast(dtype, strict=False)
+            for col, dtype in IMPORT_DTYPES.items()
+        }
+        # a value that can't be converted would silently become null, so report those instead
+        failed_values = combined_data.select(
+            pl.col("material_id").alias("id"),
+            **{
+                col: expr.is_null() & pl.col(col).is_not_null()
+                for col, expr in dtype_exprs.items()
+            },
+        )
+        errlist = []
+        for col, dtype in IMPORT_DTYPES.items():
+            ids = failed_values.filter(pl.col(col)).get_column("id")
+            if not ids.is_empty():
+                shown_ids = ", ".join(ids.head(10))
+                if len(ids) > 10:
+                    shown_ids += ", ..."
+                errlist.append(
+                    f"{len(ids)} value(s) in column '{col}' are not a valid {dtype}, for material_id(s): {shown_ids}"
+                )
+        if errlist:
+            warn(
+                "Not creating an import sheet, fix these values in the sheets first:\n  - "
+                + "\n  - ".join(errlist)
+            )
+            return
+        import_data = combined_data.select(
+            dtype_exprs.get(col, pl.col(col)).alias(header)
+            for col, header in import_columns.items()
+            if col in combined_data.columns
+        )
+
+        filename = self.dirs["copyright_import"].numbered_filename(
+            f"copyright_import_{datetime.now().strftime('%Y-%m-%d')}", ".xlsx"
+        )
+        file = File(str(self.dirs["copyright_import"].full / filename))
+        self.write_import_sheet(import_data, file)
+        info(f"Created sheet: {file.path}")
+        warn(
+            "The import sheet does not contain the data entered in the 'Data entry' sheets yet, only the data from 'Complete data'. Check it before importing it into CopyRight!"
+        )
+
+    def read_copyright_columns(self) -> dict[str, str]:
+        """
+        Returns the EA column name -> CopyRight export header mapping, in the order of the export.
+        These are recorded in process_copyright_export; if no export was processed in this run,
+        the headers are read from the newest file in the copyright_export dir.
+        Returns an empty dict if there is no export.
+        """
+        if not self.copyright_columns:
+            exports = [
+                file
+                for file in self.dirs["copyright_export"].files
+                if file.extension in [".xls", ".xlsx"]
+            ]
+            if exports:
+                newest_export = max(exports, key=lambda x: x._stat.st_birthtime)
+                self.copyright_columns = {
+                    copyright_column_name(col): col
+                    for col in read_excel(newest_export.path).columns
+                }
+        return self.copyright_columns
+
+    def write_import_sheet(self, import_data: pl.DataFrame, file: File) -> None:
+        """
+        Writes the import data to a plain Excel sheet, row by row.
+        The workbook is opened in constant_memory mode, so only the current row is kept in memory.
+        """
+        with self.open_workbook(file, constant_memory=True) as wb:
+            worksheet = wb.add_worksheet()
+            worksheet.write_row(0, 0, import_data.columns)
+            for row, values in enumerate(import_data.iter_rows(), start=1):
+                worksheet.write_row(row, 0, values)
 
 
 if __name__ == "__main__":